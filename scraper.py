@@ -1,74 +1,74 @@
-import wmi
+import win32com.client
 import os
-import time
-from prometheus_client import start_http_server, Gauge
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from prometheus_client import make_wsgi_app, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
 
 ''' ensure open hardware monitor is installed to read values from WMI '''
 ''' https://openhardwaremonitor.org/ '''
 
-def collect_data():
-    w = wmi.WMI(namespace="root\OpenHardwareMonitor")
-    temperature_infos = w.Sensor()
-    values = { 'temperature': {}, 'power': {}, 'fan': {} }
-    for sensor in temperature_infos:
-        if sensor.SensorType==u'Temperature':
-            values['temperature'][sensor.Name] = sensor.Value
-        if sensor.SensorType==u'Power':
-            values['power'][sensor.Name] = sensor.Value
-        if sensor.SensorType==u'Fan':
-            values['fan'][sensor.Name] = sensor.Value
-    return values
+# OHM SensorType -> (metric name, description, label names) of its metric
+SENSOR_TYPES = {
+    u'Temperature': ("temperature_degrees", "Current temperature", ["temperature_sensor"]),
+    u'Power': ("power_watts", "Current power usage", ["power_sensor"]),
+    u'Fan': ("fan_rpm", "Current fan speed", ["fan_sensor"]),
+}
 
-class AppMetrics:
-    def __init__(self, polling_interval_seconds=5):
-        self.polling_interval_seconds = polling_interval_seconds
+# only ask WMI for the columns and sensor types we export, so load/clock/
+# voltage/... sensors are never marshalled into python objects
+SENSOR_QUERY = "SELECT SensorType, Name, Value FROM Sensor WHERE " + " OR ".join(
+    "SensorType='%s'" % sensor_type for sensor_type in SENSOR_TYPES
+)
 
-        # Prometheus metrics to collect
-        self.temperature = Gauge(
-            "temperature_degrees",
-            "Current temperature",
-            ["temperature_sensor"]
-        )
-        self.power = Gauge(
-            "power_watts",
-            "Current power usage",
-            ["power_sensor"]
-        )
-        self.fan = Gauge(
-            "fan_rpm",
-            "Current fan speed",
-            ["fan_sensor"]
-        )
+# wbemFlagReturnImmediately | wbemFlagForwardOnly: stream the results and let
+# WMI release each object once we've moved past it
+QUERY_FLAGS = 0x10 | 0x20
 
-    def run_metrics_loop(self):
-        while True:
-            self.fetch()
-            time.sleep(self.polling_interval_seconds)
+def collect_data(w):
+    # yield readings one at a time instead of building a list of them
+    for sensor in w.ExecQuery(SENSOR_QUERY, "WQL", QUERY_FLAGS):
+        # WQL compares strings case-insensitively, so the WHERE clause alone
+        # doesn't guarantee SensorType is an exact key of SENSOR_TYPES
+        sensor_type = sensor.SensorType
+        if sensor_type in SENSOR_TYPES:
+            yield sensor_type, sensor.Name, sensor.Value
 
-    def fetch(self):
-        # Fetch raw data from the wmi
-        data = collect_data()
+class OHMCollector:
+    def __init__(self):
+        # keep one WMI connection open for every scrape instead of reconnecting
+        self.connection = win32com.client.GetObject(r"winmgmts:\\.\root\OpenHardwareMonitor")
 
-        # Update Prometheus metrics with application metrics
-        for key, value in data['temperature'].items():
-            self.temperature.labels(key).set(value)
-        for key, value in data['fan'].items():
-            self.fan.labels(key).set(value)
-        for key, value in data['power'].items():
-            self.power.labels(key).set(value)
+    def collect(self):
+        # read the sensors only when prometheus scrapes, so sensors that
+        # disappear are simply not reported and there is no polling loop
+        values = { sensor_type: {} for sensor_type in SENSOR_TYPES }
+        for sensor_type, name, value in collect_data(self.connection):
+            # sensor names aren't unique (every drive has a "Temperature"),
+            # keep the last value per name so no series is emitted twice
+            values[sensor_type][name] = value
+
+        for sensor_type, (name, description, labels) in SENSOR_TYPES.items():
+            metric = GaugeMetricFamily(name, description, labels=labels)
+            for sensor_name, value in values[sensor_type].items():
+                metric.add_metric([sensor_name], value)
+            yield metric
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # scrapes are served one at a time, so don't let a stalled client
+    # hold the server forever
+    timeout = 10
+
+    def log_message(self, format, *args):
+        pass
 
-        #getattr(object, attrname)
-        #setattr(object, attrname, value)
-           
 def main():
-    polling_interval_seconds = int(os.getenv("POLLING_INTERVAL_SECONDS", "5"))
     exporter_port = int(os.getenv("EXPORTER_PORT", "9877"))
 
-    app_metrics = AppMetrics(
-        polling_interval_seconds=polling_interval_seconds
-    )
-    start_http_server(exporter_port)
-    app_metrics.run_metrics_loop()
+    REGISTRY.register(OHMCollector())
+    # COM objects belong to the thread that created them, so serve scrapes
+    # from this thread rather than from start_http_server's worker threads
+    httpd = make_server("", exporter_port, make_wsgi_app(), handler_class=QuietRequestHandler)
+    httpd.serve_forever()
 
 if __name__ == "__main__":
     main()
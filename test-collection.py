@@ -1,10 +1,10 @@
-import wmi
+import win32com.client
 from pprint import pprint
 import json
 
 def main():
-    w = wmi.WMI(namespace="root\OpenHardwareMonitor")
-    temperature_infos = w.Sensor()
+    w = win32com.client.GetObject(r"winmgmts:\\.\root\OpenHardwareMonitor")
+    temperature_infos = w.ExecQuery("SELECT SensorType, Name, Value FROM Sensor")
     values = { 'temp': {}, 'power': {}, 'fan': {} }
     for sensor in temperature_infos:
         if sensor.SensorType==u'Temperature':